@@ -1,11 +1,14 @@
 
 import streamlit as st
 import pandas as pd
-import math
+import numpy as np
+from math import isnan
+import os
+from collections import namedtuple
 from datetime import datetime
-from io import BytesIO
 from fpdf import FPDF
-from datetime import datetime
+from fpdf.enums import XPos, YPos
+from fpdf.fonts import FontFace
 import base64
 
 st.set_page_config(page_title="Neonatal ECG Assistant", layout="centered")
@@ -29,9 +32,7 @@ ECG_SVG = '''
 </svg>
 '''.strip()
 
-ECG_BG = base64.b64encode(ECG_SVG.encode()).decode()
-
-css_block = '''
+CSS_TEMPLATE = '''
 <style>
   .ecg-block {
     background-image: url("data:image/svg+xml;base64,REPLACE_ECG_BG");
@@ -55,39 +56,48 @@ css_block = '''
     color:#5c5f63;
   }
 </style>
-'''.replace("REPLACE_ECG_BG", ECG_BG)
+'''
+
+# encode + substitute once per process, not on every rerun
+@st.cache_resource
+def ecg_css() -> str:
+    ecg_bg = base64.b64encode(ECG_SVG.encode()).decode()
+    return CSS_TEMPLATE.replace("REPLACE_ECG_BG", ecg_bg)
 
-st.markdown(css_block, unsafe_allow_html=True)
+st.markdown(ecg_css(), unsafe_allow_html=True)
 
 # ------------------------------
 # Load Excel (Sheet 1 & 4)
 # ------------------------------
-@st.cache_data
-def load_reference_data():
+REF_XLSX = "Neonatal_ECG_Pack.xlsx"
+REF_SHEETS = [0, 3]  # Sheet 1 (reference) and Sheet 4 (axis wizard)
+REF_CACHE_DIR = ".cache"
+REF_PARQUET = [os.path.join(REF_CACHE_DIR, "sheet1.parquet"), os.path.join(REF_CACHE_DIR, "sheet4.parquet")]
+
+def read_reference_excel():
+    # one parse of the workbook for both sheets; calamine is much faster than openpyxl
     try:
-        xls = pd.ExcelFile("Neonatal_ECG_Pack.xlsx")
-        sheet_names = xls.sheet_names
-        sheet1 = pd.read_excel(xls, sheet_names[0])
-        sheet4 = pd.read_excel(xls, sheet_names[3])
-        return sheet1, sheet4, sheet_names
-    except Exception as e:
-        st.warning(f"Could not load reference Excel: {e}")
-        return pd.DataFrame(), pd.DataFrame(), []
+        sheets = pd.read_excel(REF_XLSX, sheet_name=REF_SHEETS, engine="calamine")
+    except ImportError:
+        sheets = pd.read_excel(REF_XLSX, sheet_name=REF_SHEETS, engine="openpyxl")
+    return [sheets[i] for i in REF_SHEETS]
+
+def parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    # the sheets mix numbers and text in one column (e.g. "Step": 1, 2, …, "RESULT"),
+    # which Arrow (parquet, st.dataframe) cannot store; keep such columns as text, NaN stays NaN
+    obj = df.select_dtypes(include="object").columns
+    return df.assign(**{c: df[c].where(df[c].isna(), df[c].astype(str)) for c in obj})
+
+def arrow_backed(df: pd.DataFrame) -> pd.DataFrame:
+    # Arrow-backed dtypes: string filtering runs in Arrow kernels instead of on Python objects
+    try:
+        return df.convert_dtypes(dtype_backend="pyarrow")
+    except ImportError:
+        return df
 
-ref_df, axis_df, sheet_names = load_reference_data()
+ColMap = namedtuple("ColMap", "param_col min_col max_col age_col age_min_col age_max_col")
 
-st.title("🩺 Neonatal ECG Assistant (v2.0)")
-st.caption("Educational decision-support only — clinician review required.")
-
-# ------------------------------
-# Helper: detect ranges from Sheet 1
-# Expected columns (flexible): Parameter, Min/Lower, Max/Upper, Age or AgeGroup
-# ------------------------------
-def get_range_from_ref(parameter: str, age_days: int):
-    if ref_df.empty:
-        return None, None, None
-
-    df = ref_df.copy()
+def _detect_columns(df: pd.DataFrame) -> ColMap:
     # heuristics for columns
     param_col = None
     min_col = None
@@ -111,101 +121,176 @@ def get_range_from_ref(parameter: str, age_days: int):
         if age_max_col is None and ("age_max" in cl or "agemax" in cl or "upper_age" in cl):
             age_max_col = c
 
-    # filter by parameter
-    if param_col is not None:
-        df = df[df[param_col].astype(str).str.strip().str.lower().eq(parameter.strip().lower())]
-
-    # age filtering
-    if age_min_col and age_max_col and (age_min_col in df.columns) and (age_max_col in df.columns):
-        df = df[(pd.to_numeric(df[age_min_col], errors="coerce") <= age_days) & (age_days <= pd.to_numeric(df[age_max_col], errors="coerce"))]
-    elif age_col is not None and (age_col in df.columns):
-        # try to map age groups by simple keywords
-        candidates = []
-        for idx, r in df.iterrows():
-            val = str(r[age_col]).lower()
-            ok = False
-            if age_days == 0 and any(k in val for k in ["<1", " day", "0-1"]):
-                ok = True
-            elif 1 <= age_days <= 7 and any(k in val for k in ["1–7", "1-7", "week", "7"]):
-                ok = True
-            elif age_days > 7 and any(k in val for k in [">7", "month", "1 month", "30"]):
-                ok = True
-            if ok or "all" in val:
-                candidates.append(idx)
-        if candidates:
-            df = df.loc[candidates]
-
-    # extract min/max
+    return ColMap(param_col, min_col, max_col, age_col, age_min_col, age_max_col)
+
+@st.cache_data
+def load_reference_data():
+    # prefer the parquet sidecars written on a previous cold start, unless the
+    # workbook has been modified since
+    try:
+        if os.path.getmtime(REF_XLSX) <= min(os.path.getmtime(p) for p in REF_PARQUET):
+            sheet1, sheet4 = [arrow_backed(pd.read_parquet(p, engine="pyarrow")) for p in REF_PARQUET]
+            return sheet1, sheet4, tuple(_detect_columns(sheet1))
+    except Exception:
+        pass
+    try:
+        # same normalisation as the parquet path, so cold and warm starts agree
+        sheet1, sheet4 = [arrow_backed(parquet_safe(df)) for df in read_reference_excel()]
+    except Exception as e:
+        st.warning(f"Could not load reference Excel: {e}")
+        return pd.DataFrame(), pd.DataFrame(), tuple(_detect_columns(pd.DataFrame()))
+    try:
+        os.makedirs(REF_CACHE_DIR, exist_ok=True)
+        for df, p in zip((sheet1, sheet4), REF_PARQUET):
+            df.to_parquet(p, engine="pyarrow")
+    except Exception:
+        pass  # sidecar is only a speed-up (no pyarrow / read-only disk)
+    return sheet1, sheet4, tuple(_detect_columns(sheet1))
+
+# column names are detected once inside the cached loader; it returns a plain tuple
+# since st.cache_data pickles results and ColMap lives in the rerun-swapped __main__
+ref_df, axis_df, ref_cols = load_reference_data()
+COL_MAP = ColMap(*ref_cols)
+
+st.title("🩺 Neonatal ECG Assistant (v2.0)")
+st.caption("Educational decision-support only — clinician review required.")
+
+# ------------------------------
+# Helper: detect ranges from Sheet 1
+# Expected columns (flexible): Parameter, Min/Lower, Max/Upper, Age or AgeGroup
+# ------------------------------
+# age bands (inclusive, in days) for keyword-style age groups
+AGE_BANDS = {
+    "newborn": (0, 0),
+    "week": (1, 7),
+    "month": (8, np.inf),
+}
+
+# label keywords per band (plain substring alternations); kept as strings so that
+# str.contains also works on Arrow-backed columns, and only used in the cached builder
+AGE_PATTERNS = {
+    "newborn": r"<1| day|0-1",
+    "week": r"1–7|1-7|week|7",
+    "month": r">7|month|1 month|30",
+}
+
+def as_text(col: pd.Series) -> pd.Series:
+    # keep string columns (ArrowDtype / StringDtype) as-is, missing -> ""; anything else via str()
+    if isinstance(col.dtype, (pd.ArrowDtype, pd.StringDtype)) and col.dtype.type is str:
+        return col.fillna("")
+    return col.astype(str)
+
+def age_group_bands(labels: pd.Series):
+    # (age_min, age_max, row mask) per band, one regex pass over all labels
+    bands = [(*AGE_BANDS[k], labels.str.contains(pat, regex=True).to_numpy(bool)) for k, pat in AGE_PATTERNS.items()]
+    bands.append((-np.inf, np.inf, labels.str.contains("all", regex=False).to_numpy(bool)))
+    return bands
+
+@st.cache_data
+def build_range_index(ref_df: pd.DataFrame, cols: ColMap):
+    # Scan Sheet 1 once. Returns (by_age_group, table) where table maps
+    # the lower-cased parameter (None if no parameter column) to (age_min, age_max, lo, hi)
+    # rows in sheet order. Age-group rows appear once with NaN ages (fallback when no
+    # group matches) and once per age band their label matches.
+    param_col, min_col, max_col, age_col, age_min_col, age_max_col = cols
+
+    n = len(ref_df)
+    nan_col = np.full(n, np.nan)
+
+    def numeric(col):
+        if col is None:
+            return nan_col
+        return pd.to_numeric(ref_df[col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+    lo = numeric(min_col)
+    hi = numeric(max_col)
+    keys = (as_text(ref_df[param_col]).str.strip().str.lower().tolist()
+            if param_col is not None else [None] * n)
+
+    by_age_group = False
+    if age_min_col and age_max_col:
+        rows = np.column_stack([numeric(age_min_col), numeric(age_max_col), lo, hi])
+        row_keys = keys
+    elif age_col is not None:
+        by_age_group = True
+        labels = as_text(ref_df[age_col]).str.lower()
+        idx = np.arange(n)
+        parts = [(np.nan, np.nan, idx)] + [(a_min, a_max, idx[m]) for a_min, a_max, m in age_group_bands(labels)]
+        row_idx = np.concatenate([p[2] for p in parts])
+        age_min = np.concatenate([np.full(p[2].size, p[0]) for p in parts])
+        age_max = np.concatenate([np.full(p[2].size, p[1]) for p in parts])
+        order = np.argsort(row_idx, kind="stable")  # keep sheet order
+        row_idx = row_idx[order]
+        rows = np.column_stack([age_min[order], age_max[order], lo[row_idx], hi[row_idx]])
+        row_keys = [keys[i] for i in row_idx]
+    else:
+        rows = np.column_stack([np.full(n, -np.inf), np.full(n, np.inf), lo, hi])
+        row_keys = keys
+
+    row_keys = np.array(row_keys, dtype=object)
+    table = {k: rows[row_keys == k] for k in dict.fromkeys(row_keys.tolist())}
+    return by_age_group, table
+
+# Pure in (parameter, age_days) once ref_df is loaded; memoized across reruns
+# (functools.lru_cache would be rebuilt on every rerun since the script re-executes).
+@st.cache_data(show_spinner=False)
+def get_range_from_ref(parameter: str, age_days: int):
+    if ref_df.empty:
+        return None, None, None
+
+    param_col = COL_MAP.param_col
+    by_age_group, table = build_range_index(ref_df, COL_MAP)
+    rows = table.get(parameter.strip().lower() if param_col is not None else None)
+    if rows is None:
+        return None, None, param_col
+
+    age_min, age_max = rows[:, 0], rows[:, 1]
+    mask = (age_min <= age_days) & (age_days <= age_max)
+    if by_age_group and not mask.any():
+        mask = np.isnan(age_min)  # no age group matched: use every row once
+
+    # first available min/max: one combined mask per bound, no filtered copies
     lower = None
     upper = None
-    if not df.empty:
-        if min_col in df.columns:
-            try:
-                lower = float(pd.to_numeric(df[min_col], errors="coerce").dropna().iloc[0])
-            except Exception:
-                pass
-        if max_col in df.columns:
-            try:
-                upper = float(pd.to_numeric(df[max_col], errors="coerce").dropna().iloc[0])
-            except Exception:
-                pass
-
-    return lower, upper, (param_col if param_col else None)
+    lo_ok = mask & ~np.isnan(rows[:, 2])
+    hi_ok = mask & ~np.isnan(rows[:, 3])
+    if lo_ok.any():
+        lower = float(rows[lo_ok.argmax(), 2])
+    if hi_ok.any():
+        upper = float(rows[hi_ok.argmax(), 3])
+
+    return lower, upper, param_col
 
 # ------------------------------
 # Inputs (single-column, mobile friendly)
 # ------------------------------
 st.subheader("Patient / ECG Inputs")
 
+def ecg_input(label, **kw):
+    # ECG-grid block (one markdown element) above the number input
+    st.markdown('<div class="ecg-block"></div>', unsafe_allow_html=True)
+    return st.number_input(label, **kw)
+
 age_days = st.number_input("Age (days)", min_value=0, max_value=30, value=1, step=1,
                            help="Enter postnatal age in days to apply age-appropriate reference ranges.")
 
-st.markdown('<div class="ecg-block">', unsafe_allow_html=True)
-hr_boxes = st.number_input("Heart Rate: small boxes between two R–R peaks",
-                           min_value=1.0, max_value=50.0, value=5.0, step=0.5,
-                           help="Count the number of small 1 mm boxes between two consecutive R peaks at 25 mm/s. HR = 1500 / boxes.")
-st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="ecg-block">', unsafe_allow_html=True)
-pr_boxes = st.number_input("PR interval: small boxes",
-                           min_value=1.0, max_value=15.0, value=3.0, step=0.5,
-                           help="At 25 mm/s, 1 small box = 40 ms. PR (ms) = boxes × 40.")
-st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="ecg-block">', unsafe_allow_html=True)
-qrs_boxes = st.number_input("QRS duration: small boxes",
-                            min_value=1.0, max_value=10.0, value=1.5, step=0.5,
-                            help="At 25 mm/s, 1 small box = 40 ms. QRS (ms) = boxes × 40.")
-st.markdown('</div>', unsafe_allow_html=True)
-
-st.markdown('<div class="ecg-block">', unsafe_allow_html=True)
-qt_boxes = st.number_input("QT interval: small boxes",
-                           min_value=1.0, max_value=20.0, value=8.0, step=0.5,
-                           help="At 25 mm/s, 1 small box = 40 ms. QT (ms) = boxes × 40.")
-st.markdown('</div>', unsafe_allow_html=True)
-
-comments = st.text_area("Comments / Clinical context (optional)")
+hr_boxes = ecg_input("Heart Rate: small boxes between two R–R peaks",
+                     min_value=1.0, max_value=50.0, value=5.0, step=0.5,
+                     help="Count the number of small 1 mm boxes between two consecutive R peaks at 25 mm/s. HR = 1500 / boxes.")
 
-# ------------------------------
-# Conversions
-# ------------------------------
-HR = round(1500.0 / hr_boxes, 1) if hr_boxes > 0 else None
-PR_ms = round(pr_boxes * 40.0, 1)
-QRS_ms = round(qrs_boxes * 40.0, 1)
-QT_ms = round(qt_boxes * 40.0, 1)
+pr_boxes = ecg_input("PR interval: small boxes",
+                     min_value=1.0, max_value=15.0, value=3.0, step=0.5,
+                     help="At 25 mm/s, 1 small box = 40 ms. PR (ms) = boxes × 40.")
 
-# QTc calculations (Bazett, Fridericia) — RR in seconds
-RR_ms = 60000.0 / HR if HR else None
-RR_s = RR_ms / 1000.0 if RR_ms else None
+qrs_boxes = ecg_input("QRS duration: small boxes",
+                      min_value=1.0, max_value=10.0, value=1.5, step=0.5,
+                      help="At 25 mm/s, 1 small box = 40 ms. QRS (ms) = boxes × 40.")
 
-def safe_div(x, y):
-    try:
-        return x / y
-    except Exception:
-        return None
+qt_boxes = ecg_input("QT interval: small boxes",
+                     min_value=1.0, max_value=20.0, value=8.0, step=0.5,
+                     help="At 25 mm/s, 1 small box = 40 ms. QT (ms) = boxes × 40.")
 
-QTc_Bazett = round(safe_div(QT_ms, math.sqrt(RR_s)) if RR_s and RR_s>0 else float("nan"), 1)
-QTc_Fridericia = round(safe_div(QT_ms, (RR_s ** (1.0/3.0))) if RR_s and RR_s>0 else float("nan"), 1)
+comments = st.text_area("Comments / Clinical context (optional)")
 
 # ------------------------------
 # Axis Wizard (Yes/No)
@@ -217,7 +302,8 @@ lead_aVF = st.radio("Is QRS upright (positive) in aVF?", ["Yes", "No"], horizont
 lead_V1 = st.radio("Is QRS upright (positive) in V1?", ["Yes", "No"], horizontal=True)
 lead_V6 = st.radio("Is QRS upright (positive) in V6?", ["Yes", "No"], horizontal=True)
 
-def interpret_axis(i_pos: bool, ii_pos: bool, avf_pos: bool, v1_pos: bool, v6_pos: bool, age_days: int):
+def _axis_entry(idx: int):
+    i_pos, ii_pos, avf_pos, v1_pos, v6_pos = (bool(idx >> b & 1) for b in (4, 3, 2, 1, 0))
     # Primary determination from limb leads
     if i_pos and ii_pos and avf_pos:
         base = "Normal axis"
@@ -235,41 +321,93 @@ def interpret_axis(i_pos: bool, ii_pos: bool, avf_pos: bool, v1_pos: bool, v6_po
         hint.append("Rightward precordial pattern (V1 positive, V6 not)")
     if (not v1_pos) and v6_pos:
         hint.append("Leftward precordial pattern (V6 positive, V1 not)")
+    return base, tuple(hint)
+
+# (base, hints) for every combination of the five lead polarities, indexed by
+# bits I, II, aVF, V1, V6 (MSB -> LSB); built once per process, not on every rerun
+@st.cache_resource
+def axis_table():
+    return tuple(_axis_entry(idx) for idx in range(32))
+
+def interpret_axis(i_pos: bool, ii_pos: bool, avf_pos: bool, v1_pos: bool, v6_pos: bool, age_days: int):
+    idx = (i_pos << 4) | (ii_pos << 3) | (avf_pos << 2) | (v1_pos << 1) | v6_pos
+    base, hint = axis_table()[idx]
     # Neonatal physiological note
     phys = ""
     if age_days <= 7 and "Right axis deviation" in base:
         phys = "Rightward axis may be physiological in the first week of life."
-    note = " | ".join(hint + ([phys] if phys else []))
+    note = " | ".join(hint + ((phys,) if phys else ()))
     return base, note
 
-axis_result, axis_note = interpret_axis(
-    lead_I == "Yes", lead_II == "Yes", lead_aVF == "Yes", lead_V1 == "Yes", lead_V6 == "Yes", age_days
-)
-
-st.info(f"Axis: {axis_result}" + (f" — {axis_note}" if axis_note else ""))
-
 # ------------------------------
-# Compare to reference ranges (if available)
+# Calculations (recomputed only when the inputs change)
 # ------------------------------
-def classify(value, low, high):
-    if value is None or (isinstance(value, float) and math.isnan(value)):
-        return "—"
-    if low is not None and value < low:
-        return "Low"
-    if high is not None and value > high:
-        return "High"
-    return "Normal"
-
-# Pull ranges
-hr_low, hr_high, _ = get_range_from_ref("HR", age_days)
-pr_low, pr_high, _ = get_range_from_ref("PR", age_days)
-qrs_low, qrs_high, _ = get_range_from_ref("QRS", age_days)
-qt_low, qt_high, _ = get_range_from_ref("QT", age_days)
-
 # Typical neonatal QTc thresholds if not present in sheet
 qtc_baz_low, qtc_baz_high = None, 480.0
 qtc_frd_low, qtc_frd_high = None, 460.0
 
+MEASURES = ("Age (days)", "HR (from boxes)", "PR", "QRS", "QT", "QTc (Bazett)", "QTc (Fridericia)")
+PDF_HEADERS = ["Measure", "Input", "Converted", "Reference", "Status"]
+PDF_CELL_CHARS = 28  # longer cell text is cut to fit the PDF column
+
+def compute_results(age_days, hr_boxes, pr_boxes, qrs_boxes, qt_boxes, lead_I, lead_II, lead_aVF, lead_V1, lead_V6):
+    # Conversions
+    HR = round(1500.0 / hr_boxes, 1) if hr_boxes > 0 else None
+    PR_ms = round(pr_boxes * 40.0, 1)
+    QRS_ms = round(qrs_boxes * 40.0, 1)
+    QT_ms = round(qt_boxes * 40.0, 1)
+
+    # QTc calculations (Bazett, Fridericia) — RR in seconds; both in one numpy op
+    RR_s = 60000.0 / HR / 1000.0 if HR else np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        QTc_Bazett, QTc_Fridericia = np.round(QT_ms / np.array([np.sqrt(RR_s), RR_s ** (1.0/3.0)]), 1).tolist()
+
+    axis_result, axis_note = interpret_axis(
+        lead_I == "Yes", lead_II == "Yes", lead_aVF == "Yes", lead_V1 == "Yes", lead_V6 == "Yes", age_days
+    )
+
+    # Compare to reference ranges (if available)
+    hr_low, hr_high, _ = get_range_from_ref("HR", age_days)
+    pr_low, pr_high, _ = get_range_from_ref("PR", age_days)
+    qrs_low, qrs_high, _ = get_range_from_ref("QRS", age_days)
+    qt_low, qt_high, _ = get_range_from_ref("QT", age_days)
+
+    # Classify + format all six measures in one pass; None (no value / no bound) -> NaN
+    vals = np.array([HR, PR_ms, QRS_ms, QT_ms, QTc_Bazett, QTc_Fridericia], dtype=float)
+    lows = np.array([hr_low, pr_low, qrs_low, qt_low, qtc_baz_low, qtc_frd_low], dtype=float)
+    highs = np.array([hr_high, pr_high, qrs_high, qt_high, qtc_baz_high, qtc_frd_high], dtype=float)
+    status = np.select([np.isnan(vals), vals < lows, vals > highs], ["—", "Low", "High"], default="Normal").tolist()
+    refs = np.where(np.isnan(lows) | np.isnan(highs), "—",
+                    np.char.add(np.char.add(np.char.mod("%g", lows), "–"), np.char.mod("%g", highs))).tolist()
+
+    results_df = pd.DataFrame({
+        "Measure": MEASURES,
+        "Input": [f"{age_days}", f"{hr_boxes} boxes", f"{pr_boxes} boxes", f"{qrs_boxes} boxes", f"{qt_boxes} boxes", "—", "—"],
+        "Converted": ["—", f"{HR} bpm" if HR else "—", f"{PR_ms} ms", f"{QRS_ms} ms", f"{QT_ms} ms",
+                      f"{QTc_Bazett} ms" if not isnan(QTc_Bazett) else "—",
+                      f"{QTc_Fridericia} ms" if not isnan(QTc_Fridericia) else "—"],
+        "Reference": ["—"] + refs,
+        "Status": ["—"] + status,
+    })
+
+    # PDF table cells: stringify + truncate the whole table in one numpy pass
+    cells = results_df[PDF_HEADERS].to_numpy(dtype=str)
+    cells = np.where(np.char.str_len(cells) > PDF_CELL_CHARS,
+                     np.char.add(cells.astype(f"U{PDF_CELL_CHARS - 1}"), "…"), cells)
+    pdf_rows = tuple(map(tuple, cells.tolist()))
+    return HR, hr_low, hr_high, QTc_Bazett, QTc_Fridericia, axis_result, axis_note, results_df, pdf_rows
+
+# Streamlit reruns the script on every widget event, often with nothing changed:
+# reuse the last results while the inputs are identical
+input_key = (age_days, hr_boxes, pr_boxes, qrs_boxes, qt_boxes, lead_I, lead_II, lead_aVF, lead_V1, lead_V6, comments)
+if st.session_state.get("last_key") != input_key:
+    st.session_state["results"] = compute_results(*input_key[:-1])
+    st.session_state["last_key"] = input_key
+(HR, hr_low, hr_high, QTc_Bazett, QTc_Fridericia,
+ axis_result, axis_note, results_df, pdf_rows) = st.session_state["results"]
+
+st.info(f"Axis: {axis_result}" + (f" — {axis_note}" if axis_note else ""))
+
 # Alerting
 def toast(level, msg):
     if level == "error":
@@ -283,9 +421,9 @@ if HR is not None and (hr_low is not None and HR < hr_low):
     toast("warning", f"Bradycardia: HR {HR} bpm < {hr_low} bpm (age-based)")
 if HR is not None and (hr_high is not None and HR > hr_high):
     toast("warning", f"Tachycardia: HR {HR} bpm > {hr_high} bpm (age-based)")
-if not math.isnan(QTc_Bazett) and qtc_baz_high is not None and QTc_Bazett > qtc_baz_high:
+if not isnan(QTc_Bazett) and qtc_baz_high is not None and QTc_Bazett > qtc_baz_high:
     toast("error", f"Prolonged QTc (Bazett): {QTc_Bazett} ms > {qtc_baz_high} ms")
-if not math.isnan(QTc_Fridericia) and qtc_frd_high is not None and QTc_Fridericia > qtc_frd_high:
+if not isnan(QTc_Fridericia) and qtc_frd_high is not None and QTc_Fridericia > qtc_frd_high:
     toast("error", f"Prolonged QTc (Fridericia): {QTc_Fridericia} ms > {qtc_frd_high} ms")
 if "Left axis deviation" in axis_result or "Extreme axis deviation" in axis_result:
     toast("warning", f"Axis alert: {axis_result}")
@@ -293,24 +431,6 @@ if "Left axis deviation" in axis_result or "Extreme axis deviation" in axis_resu
 # ------------------------------
 # Results table
 # ------------------------------
-ref_fmt = lambda lo, hi: (f"{lo:g}–{hi:g}" if (lo is not None and hi is not None) else "—")
-
-results_df = pd.DataFrame([
-    {"Measure": "Age (days)", "Input": age_days, "Converted": "—", "Reference": "—", "Status": "—"},
-    {"Measure": "HR (from boxes)", "Input": f"{hr_boxes} boxes", "Converted": f"{HR} bpm" if HR else "—",
-     "Reference": ref_fmt(hr_low, hr_high), "Status": classify(HR, hr_low, hr_high)},
-    {"Measure": "PR", "Input": f"{pr_boxes} boxes", "Converted": f"{PR_ms} ms",
-     "Reference": ref_fmt(pr_low, pr_high), "Status": classify(PR_ms, pr_low, pr_high)},
-    {"Measure": "QRS", "Input": f"{qrs_boxes} boxes", "Converted": f"{QRS_ms} ms",
-     "Reference": ref_fmt(qrs_low, qrs_high), "Status": classify(QRS_ms, qrs_low, qrs_high)},
-    {"Measure": "QT", "Input": f"{qt_boxes} boxes", "Converted": f"{QT_ms} ms",
-     "Reference": ref_fmt(qt_low, qt_high), "Status": classify(QT_ms, qt_low, qt_high)},
-    {"Measure": "QTc (Bazett)", "Input": "—", "Converted": f"{QTc_Bazett} ms" if not math.isnan(QTc_Bazett) else "—",
-     "Reference": ref_fmt(qtc_baz_low, qtc_baz_high), "Status": classify(QTc_Bazett, qtc_baz_low, qtc_baz_high)},
-    {"Measure": "QTc (Fridericia)", "Input": "—", "Converted": f"{QTc_Fridericia} ms" if not math.isnan(QTc_Fridericia) else "—",
-     "Reference": ref_fmt(qtc_frd_low, qtc_frd_high), "Status": classify(QTc_Fridericia, qtc_frd_low, qtc_frd_high)},
-])
-
 st.subheader("Summary")
 st.dataframe(results_df, use_container_width=True)
 
@@ -319,40 +439,29 @@ st.markdown(f"**Axis:** {axis_result}" + (f" — {axis_note}" if axis_note else
 # ------------------------------
 # PDF generation (clean, neutral)
 # ------------------------------
-def build_pdf(dataframe: pd.DataFrame, axis_text: str, axis_note: str, comments: str) -> bytes:
+# Cached on its (hashable) inputs so the FPDF work runs once per distinct state,
+# not on every rerun. `rows` is the results table as a tuple of (already truncated)
+# string tuples. The key includes the minute, so cap the number of kept PDFs.
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_pdf(rows: tuple, axis_text: str, axis_note: str, comments: str, generated: str) -> bytes:
     pdf = FPDF()
+    pdf.core_fonts_encoding = "windows-1252"  # core fonts: allow — – … × in the text
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
 
     # Title & time
-    pdf.set_font("Arial", "B", 16)
-    pdf.cell(0, 10, "Neonatal ECG Assistant", ln=1)
-    pdf.set_font("Arial", "", 11)
-    pdf.cell(0, 8, datetime.now().strftime("%Y-%m-%d %H:%M"), ln=1)
+    pdf.set_font("Helvetica", "B", 16)
+    pdf.cell(0, 10, "Neonatal ECG Assistant", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.set_font("Helvetica", "", 11)
+    pdf.cell(0, 8, generated, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
     pdf.ln(2)
 
-    # Table header
-    headers = ["Measure", "Input", "Converted", "Reference", "Status"]
-    col_w = [48, 40, 40, 35, 27]  # total ~190 incl. margins
-    pdf.set_font("Arial", "B", 11)
-    for w, h in zip(col_w, headers):
-        pdf.cell(w, 8, h, border=1)
-    pdf.ln(8)
-
-    # Table rows
-    pdf.set_font("Arial", "", 10)
-    for _, r in dataframe.iterrows():
-        row = [
-            str(r["Measure"]),
-            str(r["Input"]),
-            str(r["Converted"]),
-            str(r["Reference"]),
-            str(r["Status"]),
-        ]
-        # simple wrap: truncate to fit cell
-        for w, val in zip(col_w, row):
-            pdf.cell(w, 8, (val if len(val) <= 28 else val[:27] + "…"), border=1)
-        pdf.ln(8)
+    # Table: hand all rows to fpdf2's table renderer at once (header row bold at 11 pt)
+    col_w = (48, 40, 40, 35, 27)  # total 190 = page width minus margins
+    pdf.set_font("Helvetica", "", 10)
+    with pdf.table([PDF_HEADERS, *rows], col_widths=col_w, width=sum(col_w), line_height=8,
+                   text_align="LEFT", headings_style=FontFace(emphasis="BOLD", size_pt=11)):
+        pass
 
     pdf.ln(4)
     axis_line = axis_text + (f" — {axis_note}" if axis_note else "")
@@ -360,16 +469,24 @@ def build_pdf(dataframe: pd.DataFrame, axis_text: str, axis_note: str, comments:
 
     if comments:
         pdf.ln(2)
+        # free text may hold characters the core fonts cannot draw
+        comments = comments.encode("windows-1252", "replace").decode("windows-1252")
         pdf.multi_cell(0, 8, f"Comments: {comments}")
 
     pdf.ln(3)
-    pdf.set_font("Arial", "I", 10)
+    pdf.set_font("Helvetica", "I", 10)
     pdf.multi_cell(0, 8, "Disclaimer: This tool provides educational decision-support only. "
                          "ECG findings must be reviewed by a qualified clinician.")
 
     # Return as bytes
-    return pdf.output(dest="S").encode("latin-1")
+    return bytes(pdf.output())
 
+st.download_button(
+    "Download PDF report",
+    data=build_pdf(pdf_rows, axis_result, axis_note, comments, datetime.now().strftime("%Y-%m-%d %H:%M")),
+    file_name="neonatal_ecg_report.pdf",
+    mime="application/pdf",
+)
 
 # ------------------------------
 # Reference viewer (expanders)